@@ -1,25 +1,31 @@
 # Database: SQLite implementation
 # Production consideration: Migration to PostgreSQL recommended for scalability
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response, Request, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Response, Request, HTTPException, Path, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
-from jose import jwt as jose_jwt
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+from collections import OrderedDict
+from datetime import datetime
+import jwt
 import sqlite3
-import json
+import orjson
 import asyncio
+import time
 from pydantic import BaseModel
 
 import os
-from passlib.context import CryptContext
+import bcrypt
 
 # Application Configuration
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Security Configuration
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt is deliberately slow; hash/verify run via asyncio.to_thread so they
+# don't stall the event loop. Keep that in place if the cost factor is raised.
+# The C extension releases the GIL, so concurrent logins use separate cores.
+BCRYPT_ROUNDS = 12
 SECRET_KEY = os.getenv("SECRET_KEY", "development-secret-key-change-in-production")
 ALGORITHM = "HS256"
 
@@ -51,28 +57,146 @@ class Message(BaseModel):
     content: str
 
 # Database connection setup
-def get_db():
-    conn = sqlite3.connect('messenger.db')
+DB_PATH = 'messenger.db'
+DB_POOL_SIZE = os.cpu_count() or 4
+
+def get_db(readonly: bool = False):
+    if readonly:
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        # Take the write lock up front so a transaction never has to upgrade from a read lock
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level="IMMEDIATE")
+        # WAL lets readers proceed while a write is in progress
+        conn.execute("PRAGMA journal_mode = WAL")
     conn.row_factory = sqlite3.Row
+    conn.executescript('''
+    PRAGMA synchronous = NORMAL;
+    PRAGMA busy_timeout = 5000;
+    PRAGMA cache_size = -20000;
+    PRAGMA temp_store = memory;
+    PRAGMA foreign_keys = ON;
+    ''')
     return conn
 
+# SQL statements
+# Kept as module-level constants so every call passes the identical string and
+# hits sqlite3's per-connection prepared statement cache instead of re-parsing
+SQL_INSERT_USER = "INSERT INTO users (username, password, last_seen) VALUES (?, ?, ?)"
+SQL_SELECT_LOGIN = "SELECT id, username, password FROM users WHERE username = ?"
+SQL_SELECT_SESSION_USER = "SELECT id, username FROM users WHERE id = ?"
+# A user counts as online if seen within the last 30 seconds.
+# last_seen holds unix seconds; rows written before that hold a datetime
+# string, which SQLite coerces to a year and so reads as offline until the
+# next update.
+SQL_ONLINE = "(CAST(strftime('%s', 'now') AS INTEGER) - last_seen) < 30 AS online"
+SQL_SELECT_USER = f"SELECT id, username, {SQL_ONLINE} FROM users WHERE id = ?"
+SQL_SELECT_USER_EXCLUDING = f"SELECT id, username, {SQL_ONLINE} FROM users WHERE id = ? AND id != ?"
+SQL_LIST_USERS = f"SELECT id, username, {SQL_ONLINE} FROM users WHERE id != ?"
+# Prefix match bound as a parameter so SQLite can range-scan idx_users_username
+SQL_SEARCH_USERS = f"""
+    SELECT id, username, {SQL_ONLINE} 
+    FROM users 
+    WHERE id != ? 
+    AND username LIKE ? ESCAPE '\\'
+"""
+SQL_UPDATE_LAST_SEEN = "UPDATE users SET last_seen = ? WHERE id = ?"
+SQL_INSERT_MESSAGE = "INSERT INTO messages (sender_id, receiver_id, content, timestamp) VALUES (?, ?, ?, ?)"
+# SQLite INTEGER range
+SQLITE_INT_MIN = -2**63
+SQLITE_INT_MAX = 2**63 - 1
+
+# One leg per direction; each is a range search on idx_msg_pair that already
+# yields rows in id order, so SQLite merges the legs without sorting
+SQL_SELECT_CONVERSATION = """
+    SELECT * FROM messages 
+    WHERE sender_id = :user_id AND receiver_id = :other_id AND id < :before_id
+    UNION ALL
+    SELECT * FROM messages 
+    WHERE sender_id = :other_id AND receiver_id = :user_id AND id < :before_id
+    ORDER BY id DESC
+    LIMIT :limit
+"""
+
+# Connection pools shared by all endpoints
+# Connections stay open for the process lifetime so SQLite keeps its page cache warm
+class SQLitePool:
+    def __init__(self, size: int, readonly: bool = False):
+        self.size = size
+        self.readonly = readonly
+        self._connections: asyncio.Queue = asyncio.Queue()
+        self._all: List[sqlite3.Connection] = []
+
+    def open(self):
+        for _ in range(self.size):
+            conn = get_db(self.readonly)
+            self._all.append(conn)
+            self._connections.put_nowait(conn)
+
+    def close(self):
+        for conn in self._all:
+            conn.close()
+        self._all.clear()
+        self._connections = asyncio.Queue()
+
+    @staticmethod
+    def _call(conn: sqlite3.Connection, fn: Callable):
+        try:
+            return fn(conn)
+        finally:
+            # Never hand a connection with an open transaction to the next caller
+            if conn.in_transaction:
+                conn.rollback()
+
+    async def run(self, fn: Callable):
+        # sqlite3 is blocking, so fn(conn) runs in a worker thread to keep the
+        # event loop free. The connection only returns to the pool once the
+        # thread is done, even if the awaiting request gets cancelled.
+        conn = await self._connections.get()
+        future = asyncio.ensure_future(asyncio.to_thread(self._call, conn, fn))
+        future.add_done_callback(lambda _: self._connections.put_nowait(conn))
+        return await asyncio.shield(future)
+
+    async def fetchone(self, sql: str, params: tuple = ()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params: Union[tuple, dict] = ()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        def write(conn: sqlite3.Connection) -> int:
+            cur = conn.execute(sql, params)
+            conn.commit()
+            return cur.lastrowid
+        return await self.run(write)
+
+    async def executemany(self, sql: str, rows: List[tuple]):
+        def write(conn: sqlite3.Connection):
+            conn.executemany(sql, rows)
+            conn.commit()
+        await self.run(write)
+
+# SQLite allows a single writer at a time, so writes queue on one connection
+# while reads fan out over the read-only pool
+read_pool = SQLitePool(DB_POOL_SIZE, readonly=True)
+write_pool = SQLitePool(1)
+
 # Initialize database tables on startup
 def init_db():
     conn = get_db()
-    cur = conn.cursor()
     
-    # Users table schema
-    cur.execute('''
+    # Whole schema in one transaction, so setup costs a single commit
+    conn.executescript('''
+    BEGIN;
+    
+    -- Users table schema
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
         password TEXT NOT NULL,
         last_seen TIMESTAMP
-    )
-    ''')
+    );
     
-    # Messages table schema
-    cur.execute('''
+    -- Messages table schema
     CREATE TABLE IF NOT EXISTS messages (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         sender_id INTEGER,
@@ -81,125 +205,302 @@ def init_db():
         timestamp TIMESTAMP,
         FOREIGN KEY (sender_id) REFERENCES users (id),
         FOREIGN KEY (receiver_id) REFERENCES users (id)
-    )
-    ''')
+    );
     
-    conn.commit()
+    -- Conversation index for history lookups. Each direction is an equality
+    -- lookup on both columns, so one index serves both; the implicit trailing
+    -- rowid orders entries by message id, the pagination key.
+    DROP INDEX IF EXISTS idx_msg_pair_sr;
+    DROP INDEX IF EXISTS idx_msg_pair_rs;
+    CREATE INDEX IF NOT EXISTS idx_msg_pair ON messages (sender_id, receiver_id);
+    
+    -- Case-insensitive username index for prefix search
+    CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE);
+    
+    COMMIT;
+    ''')
     conn.close()
 
 # Initialize database
 init_db()
 
+# Message write coalescing
+# Websocket handlers enqueue rows; a single background task inserts them in
+# batches so a burst of messages shares one transaction
+MESSAGE_BATCH_SIZE = 256
+MESSAGE_BATCH_DELAY = 0.01  # seconds
+# Created on startup so the queue belongs to the running event loop
+pending_messages: Optional[asyncio.Queue] = None
+message_writer_task: Optional[asyncio.Task] = None
+
+async def message_writer():
+    running = True
+    while running:
+        batch = [await pending_messages.get()]
+        # Give the burst a moment to accumulate
+        await asyncio.sleep(MESSAGE_BATCH_DELAY)
+        while len(batch) < MESSAGE_BATCH_SIZE and not pending_messages.empty():
+            batch.append(pending_messages.get_nowait())
+        
+        # None is the shutdown sentinel, queued after every pending row
+        if None in batch:
+            running = False
+            batch = [row for row in batch if row is not None]
+        if not batch:
+            continue
+        
+        try:
+            await write_pool.executemany(SQL_INSERT_MESSAGE, batch)
+        except Exception as e:
+            print(f"Error saving messages: {str(e)}")
+            # Retry row by row so a bad row only loses itself
+            for row in batch:
+                try:
+                    await write_pool.execute(SQL_INSERT_MESSAGE, row)
+                except Exception as e:
+                    print(f"Dropping message {row[:2]}: {str(e)}")
+
+last_seen_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def startup():
+    global pending_messages, message_writer_task, last_seen_task
+    write_pool.open()
+    read_pool.open()
+    pending_messages = asyncio.Queue()
+    message_writer_task = asyncio.create_task(message_writer())
+    last_seen_task = asyncio.create_task(manager.flush_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Flush queued messages and presence updates before the connections go away
+    if message_writer_task:
+        pending_messages.put_nowait(None)
+        await message_writer_task
+    if last_seen_task:
+        last_seen_task.cancel()
+    await manager.flush_last_seen()
+    read_pool.close()
+    write_pool.close()
+
 # WebSocket Connection Manager
 # Implementation based on FastAPI documentation with custom optimizations
+# Each connection gets an outbound queue drained by its own writer task, so a
+# slow recipient never stalls the sender's receive loop
+LAST_SEEN_FLUSH_INTERVAL = 2  # seconds
+# Outbound messages buffered per connection before it is treated as stalled
+OUTBOUND_QUEUE_SIZE = 256
+
 class ConnectionManager:
     def __init__(self):
-        # Store active WebSocket connections
-        self.active_connections: Dict[int, WebSocket] = {}
+        # Store active WebSocket connections with their outbound queues
+        self.active_connections: Dict[int, Tuple[WebSocket, asyncio.Queue]] = {}
+        self._writers: Dict[int, asyncio.Task] = {}
+        # Pending last_seen updates (user_id -> unix seconds), written in batches
+        self._dirty: Dict[int, int] = {}
+        # Close calls for stalled connections, referenced until they finish
+        self._closing: Set[asyncio.Task] = set()
     
     async def connect(self, websocket: WebSocket, user_id: int):
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        # A reconnect replaces the previous connection for this user
+        self._close(user_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self.active_connections[user_id] = (websocket, queue)
+        self._writers[user_id] = asyncio.create_task(self._writer(websocket, queue))
         
         # Update user's last seen timestamp
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE users SET last_seen = ? WHERE id = ?",
-            (datetime.now(), user_id)
-        )
-        conn.commit()
-        conn.close()
+        self.touch(user_id)
+    
+    def touch(self, user_id: int):
+        self._dirty[user_id] = int(time.time())
+    
+    async def flush_last_seen(self):
+        if not self._dirty:
+            return
+        snapshot, self._dirty = self._dirty, {}
+        try:
+            await write_pool.executemany(
+                SQL_UPDATE_LAST_SEEN,
+                [(seen, user_id) for user_id, seen in snapshot.items()]
+            )
+        except Exception:
+            # Put the batch back for the next flush, keeping newer touches
+            for user_id, seen in snapshot.items():
+                self._dirty[user_id] = max(seen, self._dirty.get(user_id, seen))
+            raise
+    
+    async def flush_loop(self):
+        # Connect/disconnect flaps cost one dict write instead of a transaction each
+        while True:
+            await asyncio.sleep(LAST_SEEN_FLUSH_INTERVAL)
+            try:
+                await self.flush_last_seen()
+            except Exception as e:
+                print(f"Error saving last seen: {str(e)}")
     
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    def disconnect(self, user_id: int, websocket: WebSocket):
+        # Ignore stale disconnects from a connection that was already replaced
+        entry = self.active_connections.get(user_id)
+        if entry and entry[0] is websocket:
+            self._close(user_id)
     
-    async def send_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+    def _close(self, user_id: int):
+        self.active_connections.pop(user_id, None)
+        writer = self._writers.pop(user_id, None)
+        if writer:
+            writer.cancel()
+    
+    async def _writer(self, websocket: WebSocket, queue: asyncio.Queue):
+        while True:
+            payload = await queue.get()
+            try:
+                await websocket.send_text(payload)
+            except Exception as e:
+                # The receive loop notices the closed socket and cleans up
+                print(f"Error sending message: {str(e)}")
+                return
+    
+    def send_message(self, message: str, user_id: int):
+        entry = self.active_connections.get(user_id)
+        if not entry:
+            return
+        try:
+            entry[1].put_nowait(message)
+        except asyncio.QueueFull:
+            # Recipient stopped reading; drop the connection rather than buffer
+            # without bound. Messages are stored, so the client's reconnect
+            # reloads them from history.
+            print(f"Closing stalled connection for user {user_id}")
+            self._close(user_id)
+            task = asyncio.create_task(self._close_socket(entry[0]))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+    
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            # Already closed by the client
+            pass
 
 manager = ConnectionManager()
 
+# Password hashing
+# Hashes are stored as text; the $2b$ format is the same one passlib produced
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+def verify_password(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+# Verified against when the username doesn't exist, so unknown and known
+# usernames take the same time to reject
+DUMMY_HASH = hash_password("x" * 16)
+
 # Token Generation
 # Authentication Note: Implement refresh token mechanism for enhanced security
+# Claims are kept compact: "u" is the user id. "exp" keeps its registered
+# name so PyJWT still enforces expiry.
 def create_token(user_id: int) -> str:
-    expires = datetime.utcnow() + timedelta(days=7)
-    token = jose_jwt.encode(
-        {"user_id": user_id, "exp": expires},
+    expires = int(time.time()) + 7 * 24 * 60 * 60
+    token = jwt.encode(
+        {"u": user_id, "exp": expires},
         SECRET_KEY,
         algorithm=ALGORITHM
     )
     return token
 
+# Decoded token cache
+# Maps raw token -> (user_id, exp) so repeat requests skip signature verification
+JWT_CACHE_SIZE = 10_000
+_jwt_cache: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+
 # JWT token validation
-async def get_current_user(request: Request) -> Optional[int]:
-    token = request.cookies.get("session")
+def decode_session(token: Optional[str]) -> Optional[int]:
     if not token:
-        print("No session cookie found")
         return None
     
+    cached = _jwt_cache.get(token)
+    if cached:
+        if cached[1] > time.time():
+            _jwt_cache.move_to_end(token)
+            return cached[0]
+        # Expired, fall through so decode reports it
+        _jwt_cache.pop(token, None)
+    
     try:
-        payload = jose_jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Tokens issued before the compact claims still carry "user_id"
+        user_id = payload.get("u") or payload.get("user_id")
         if not user_id:
             print("No user_id in token payload")
             return None
+        _jwt_cache[token] = (user_id, payload["exp"])
+        if len(_jwt_cache) > JWT_CACHE_SIZE:
+            _jwt_cache.popitem(last=False)
         return user_id
     except Exception as e:
         print(f"Error decoding token: {str(e)}")
         return None
 
+# Authentication middleware
+# Resolves the session cookie once per HTTP request into request.state.user_id
+# (None when missing or invalid); endpoints check it inline.
+# Written as plain ASGI rather than BaseHTTPMiddleware to avoid its per-request
+# task and body streaming overhead.
+class AuthMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            token = Request(scope).cookies.get("session")
+            scope.setdefault("state", {})["user_id"] = decode_session(token)
+        await self.app(scope, receive, send)
+
+app.add_middleware(AuthMiddleware)
+
 # User Registration Endpoint
 @app.post("/register")
 async def register(user: User, response: Response):
-    conn = get_db()
-    cur = conn.cursor()
+    # Hash password before storing
+    hashed_password = await asyncio.to_thread(hash_password, user.password)
     
     try:
-        # Hash password before storing
-        hashed_password = pwd_context.hash(user.password)
-        cur.execute(
-            "INSERT INTO users (username, password, last_seen) VALUES (?, ?, ?)",
-            (user.username.lower(), hashed_password, datetime.now())
+        user_id = await write_pool.execute(
+            SQL_INSERT_USER,
+            (user.username.lower(), hashed_password, int(time.time()))
         )
-        conn.commit()
-        user_id = cur.lastrowid
-        
-        # Generate token and set cookie
-        token = create_token(user_id)
-        response.set_cookie(
-            key="session",
-            value=token,
-            httponly=True,
-            secure=False,  # For local development
-            samesite='lax',
-            max_age=7 * 24 * 60 * 60,
-            path='/',
-            domain=None  # Important for local development
-        )
-        
-        return {"id": user_id, "username": user.username}
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="User already exists")
-    finally:
-        conn.close()
+    
+    # Generate token and set cookie
+    token = create_token(user_id)
+    response.set_cookie(
+        key="session",
+        value=token,
+        httponly=True,
+        secure=False,  # For local development
+        samesite='lax',
+        max_age=7 * 24 * 60 * 60,
+        path='/',
+        domain=None  # Important for local development
+    )
+    
+    return {"id": user_id, "username": user.username}
 
 # User login endpoint
 @app.post("/login")
 async def login(user: User, response: Response):
-    conn = get_db()
-    cur = conn.cursor()
-    
     # Get user by username
-    cur.execute(
-        "SELECT id, username, password FROM users WHERE username = ?",
-        (user.username.lower(),)
-    )
-    result = cur.fetchone()
+    result = await read_pool.fetchone(SQL_SELECT_LOGIN, (user.username.lower(),))
+    
+    # Verify password, always running bcrypt to avoid a timing side channel
+    target = result['password'] if result else DUMMY_HASH
+    ok = await asyncio.to_thread(verify_password, user.password, target)
     
-    # Verify password
-    if result and pwd_context.verify(user.password, result['password']):
+    if result and ok:
         token = create_token(result['id'])
         is_secure = os.getenv("ENVIRONMENT", "development") == "production"
         response.set_cookie(
@@ -214,37 +515,15 @@ async def login(user: User, response: Response):
         return {"id": result['id'], "username": result['username']}
     
     raise HTTPException(status_code=400, detail="Invalid username or password")
-    result = cur.fetchone()
-    conn.close()
-    
-    if result:
-        # Generate token and set cookie
-        token = create_token(result['id'])
-        response.set_cookie(
-            key="session",
-            value=token,
-            httponly=True,
-            secure=False,  # For local development
-            samesite='lax',
-            max_age=7 * 24 * 60 * 60,
-            path='/',
-            domain=None  # Important for local development
-        )
-        return {"id": result['id'], "username": result['username']}
-    
-    raise HTTPException(status_code=400, detail="Invalid username or password")
 
 # Session validation endpoint
 @app.get("/check-session")
-async def check_session(user_id: Optional[int] = Depends(get_current_user)):
+async def check_session(request: Request):
+    user_id = request.state.user_id
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authorized")
     
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, username FROM users WHERE id = ?", (user_id,))
-    user = cur.fetchone()
-    conn.close()
+    user = await read_pool.fetchone(SQL_SELECT_SESSION_USER, (user_id,))
     
     if user:
         return {"id": user['id'], "username": user['username']}
@@ -253,18 +532,11 @@ async def check_session(user_id: Optional[int] = Depends(get_current_user)):
 
 # Get user by ID endpoint
 @app.get("/users/{user_id}")
-async def get_user_by_id(
-    user_id: int,
-    current_user: Optional[int] = Depends(get_current_user)
-):
-    if not current_user:
+async def get_user_by_id(user_id: int, request: Request):
+    if not request.state.user_id:
         raise HTTPException(status_code=401, detail="Not authorized")
     
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT id, username, last_seen FROM users WHERE id = ?", (user_id,))
-    user = cur.fetchone()
-    conn.close()
+    user = await read_pool.fetchone(SQL_SELECT_USER, (user_id,))
     
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -272,124 +544,131 @@ async def get_user_by_id(
     return {
         "id": user['id'],
         "username": user['username'],
-        "online": (datetime.now() - datetime.fromisoformat(user['last_seen'])).seconds < 30
+        "online": bool(user['online'])
     }
 
 # Get users list endpoint
 @app.get("/users")
-async def get_users(
-    request: Request,
-    search: Optional[str] = None,
-    current_user: Optional[int] = Depends(get_current_user)
-):
+async def get_users(request: Request, search: Optional[str] = None):
+    current_user = request.state.user_id
     if not current_user:
-        # Direct cookie check for debugging
-        cookies = request.cookies
         raise HTTPException(status_code=401, detail="Not authorized")
     
-    conn = get_db()
-    cur = conn.cursor()
-    
     if search and search.isdigit():
         # Search by ID
-        cur.execute(
-            "SELECT id, username, last_seen FROM users WHERE id = ? AND id != ?",
-            (int(search), current_user)
-        )
+        users = await read_pool.fetchall(SQL_SELECT_USER_EXCLUDING, (int(search), current_user))
+    elif search:
+        # Search by username prefix, treating LIKE wildcards in the input literally
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        users = await read_pool.fetchall(SQL_SEARCH_USERS, (current_user, escaped + '%'))
     else:
-        # Search by username or get all users
-        query = """
-            SELECT id, username, last_seen 
-            FROM users 
-            WHERE id != ? 
-            AND (? IS NULL OR LOWER(username) LIKE LOWER(?))
-        """
-        search_pattern = f"%{search}%" if search else None
-        cur.execute(query, (current_user, search, search_pattern))
-    
-    users = cur.fetchall()
-    conn.close()
+        users = await read_pool.fetchall(SQL_LIST_USERS, (current_user,))
     
     return [
         {
             "id": user['id'],
             "username": user['username'],
-            "online": (datetime.now() - datetime.fromisoformat(user['last_seen'])).seconds < 30
+            "online": bool(user['online'])
         }
         for user in users
     ]
 
+# Chat frame validation
+# receiver_id must fit SQLite's signed 64-bit INTEGER and content must be text
+def is_valid_message(receiver_id, content) -> bool:
+    return (
+        isinstance(receiver_id, int)
+        and not isinstance(receiver_id, bool)
+        and SQLITE_INT_MIN <= receiver_id <= SQLITE_INT_MAX
+        and isinstance(content, str)
+    )
+
 # WebSocket Implementation
 # Features:
 # - Stable reconnection handling
 # - Robust error management
 # - Real-time message delivery
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: int = Path(ge=SQLITE_INT_MIN, le=SQLITE_INT_MAX)
+):
     await manager.connect(websocket, user_id)
     try:
         while True:
             # Receive message from WebSocket
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
+            # Read the raw ASGI frame so both text and binary frames are accepted
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            data = frame.get("text")
+            try:
+                message_data = orjson.loads(data if data is not None else frame["bytes"])
+                receiver_id = message_data['receiver_id']
+                content = message_data['content']
+            except (orjson.JSONDecodeError, TypeError, KeyError):
+                message_data = None
+            if message_data is None or not is_valid_message(receiver_id, content):
+                # Reject the frame: neither stored nor forwarded
+                print(f"Rejected malformed message from user {user_id}")
+                continue
+            timestamp = datetime.now()
             
-            # Save message to database
-            conn = get_db()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO messages (sender_id, receiver_id, content, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, message_data['receiver_id'], message_data['content'], datetime.now())
-            )
-            conn.commit()
-            conn.close()
+            # Queue message for the batched database writer
+            await pending_messages.put((user_id, receiver_id, content, timestamp))
             
             # Send message to recipient if online
-            await manager.send_message(data, message_data['receiver_id'])
+            # Encoded once here; the writer task only forwards the string
+            payload = orjson.dumps({
+                "sender_id": user_id,
+                "receiver_id": receiver_id,
+                "content": content,
+                # str() matches how the sqlite3 adapter stores it, so /messages
+                # returns the same format
+                "timestamp": str(timestamp),
+            }).decode()
+            manager.send_message(payload, receiver_id)
             
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        # Runs on any exit so a failed loop can't leave a dead socket registered
+        manager.disconnect(user_id, websocket)
         
         # Update last seen timestamp
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE users SET last_seen = ? WHERE id = ?",
-            (datetime.now(), user_id)
-        )
-        conn.commit()
-        conn.close()
+        manager.touch(user_id)
 
 # Message History Endpoint
-# Implementation Note: Future enhancement to implement cursor-based pagination
+# Cursor-based pagination: pass the returned next_cursor as before_id to page back
+MESSAGES_PAGE_SIZE = 100
+
 @app.get("/messages/{other_user_id}")
 async def get_messages(
-    other_user_id: int,
-    user_id: Optional[int] = Depends(get_current_user)
+    request: Request,
+    other_user_id: int = Path(ge=SQLITE_INT_MIN, le=SQLITE_INT_MAX),
+    before_id: Optional[int] = Query(None, ge=SQLITE_INT_MIN, le=SQLITE_INT_MAX)
 ):
+    user_id = request.state.user_id
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authorized")
     
-    conn = get_db()
-    cur = conn.cursor()
-    # Get total message count
-    cur.execute("""
-        SELECT COUNT(*) as count FROM messages 
-        WHERE (sender_id = ? AND receiver_id = ?)
-        OR (sender_id = ? AND receiver_id = ?)
-    """, (user_id, other_user_id, other_user_id, user_id))
-    total_count = cur.fetchone()['count']
-
-    # Get last 100 messages sorted by timestamp
-    cur.execute("""
-        SELECT * FROM messages 
-        WHERE (sender_id = ? AND receiver_id = ?)
-        OR (sender_id = ? AND receiver_id = ?)
-        ORDER BY timestamp ASC
-        LIMIT 100
-    """, (user_id, other_user_id, other_user_id, user_id))
-    
-    messages = cur.fetchall()
-    conn.close()
+    # Fetch one extra row to learn whether older messages exist
+    messages = await read_pool.fetchall(
+        SQL_SELECT_CONVERSATION,
+        {
+            "user_id": user_id,
+            "other_id": other_user_id,
+            # No cursor means start from the newest message
+            "before_id": before_id if before_id is not None else SQLITE_INT_MAX,
+            "limit": MESSAGES_PAGE_SIZE + 1,
+        }
+    )
+    
+    has_more = len(messages) > MESSAGES_PAGE_SIZE
+    messages = messages[:MESSAGES_PAGE_SIZE]
+    next_cursor = messages[-1]['id'] if has_more else None
+    # Newest-first from the query, oldest-first for the client
+    messages.reverse()
     
     return {
         "messages": [
@@ -402,16 +681,20 @@ async def get_messages(
             }
             for msg in messages
         ],
-        "total_count": total_count,
-        "has_more": total_count > 100
+        "has_more": has_more,
+        "next_cursor": next_cursor
     }
 
 # User logout endpoint
 @app.post("/logout")
-async def logout(response: Response, user_id: Optional[int] = Depends(get_current_user)):
+async def logout(request: Request, response: Response):
+    user_id = request.state.user_id
     if not user_id:
         raise HTTPException(status_code=401, detail="Not authorized")
     
+    # Forget the cached decode for this token
+    _jwt_cache.pop(request.cookies.get("session"), None)
+    
     # Remove session cookie
     response.delete_cookie(
         key="session",
@@ -422,14 +705,7 @@ async def logout(response: Response, user_id: Optional[int] = Depends(get_curren
     )
     
     # Update last seen timestamp
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET last_seen = ? WHERE id = ?",
-        (datetime.now(), user_id)
-    )
-    conn.commit()
-    conn.close()
+    await write_pool.execute(SQL_UPDATE_LAST_SEEN, (int(time.time()), user_id))
     
     return {"message": "Successfully logged out"}
 
@@ -443,8 +719,8 @@ if __name__ == "__main__":
         print("Performing graceful shutdown...")
         try:
             # Close database connections
-            conn = get_db()
-            conn.close()
+            read_pool.close()
+            write_pool.close()
         except:
             pass
         sys.exit(0)
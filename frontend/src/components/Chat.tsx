@@ -138,7 +138,8 @@ function Chat({ user }: ChatProps) {
                 ...u,
                 lastMessage: lastMessage.content,
                 lastMessageTime: lastMessage.timestamp,
-                totalMessages: msgResponse.data.total_count
+                // Exact count is only known when the whole history fits in one page
+                totalMessages: msgResponse.data.has_more ? undefined : messages.length
               };
             }
             return u;
@@ -210,7 +211,7 @@ function Chat({ user }: ChatProps) {
       try {
         const response = await api.get(API_ENDPOINTS.MESSAGES(selectedUser.id));
         setMessages(response.data.messages);
-        setTotalMessages(response.data.total_count);
+        setTotalMessages(response.data.messages.length);
         setHasMoreMessages(response.data.has_more);
         setUnreadMessages((prev) => ({ ...prev, [selectedUser.id]: 0 }));
       } catch (error) {
@@ -404,7 +405,7 @@ function Chat({ user }: ChatProps) {
                       <>
                         <Text c="dimmed" size="xs" ta="center">
                           {hasMoreMessages 
-                            ? `Showing last ${messages.length} of ${totalMessages} messages`
+                            ? `Showing last ${messages.length} messages`
                             : `Total messages: ${totalMessages}`
                           }
                         </Text>